@@ -3,6 +3,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.optimize import curve_fit
+import calib_data
 
 def get_input():
     '''Obtains raw bin number and peak energy data
@@ -11,15 +12,7 @@ def get_input():
     while good_data == False:
         try:
             #input_name = input('Enter data file name with extension (e.g. .txt): ')
-            input_ref = open('source_data.txt', 'r')
-            input_contents = []
-            for line in input_ref:
-                line = line.strip()
-                data_list = line.split(',')
-                for i in range(len(data_list)):
-                    data_list[i] = float(data_list[i])
-                input_contents.append(data_list)
-            input_ref.close()
+            input_contents = calib_data.read_points('source_data.txt')
             good_data = True
         except FileNotFoundError:
             print('File not found.\nPlease enter a valid file name.')
@@ -27,11 +20,7 @@ def get_input():
 
 def format_data(data_list):
     '''Organizes raw bin and energy data into lists for plotting'''
-    bin_list = []
-    energy_list = []
-    for data_pair in data_list:
-        bin_list.append(data_pair[0])
-        energy_list.append(data_pair[1])
+    bin_list, energy_list = calib_data.unpack(data_list)
     return bin_list, energy_list
 
 def lin_fit(x, m, b):
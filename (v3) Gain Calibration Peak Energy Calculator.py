@@ -5,14 +5,15 @@
 import math
 import numpy
 from scipy import interpolate
+import line_catalogue
 
-def getInput(materials):
+def getInput(materials, catalogue):
     '''Stores user energy-intensity-intensity error data triples  
        as dictionary key-value pairs and gets housing thickness'''
+    line_dict = line_catalogue.input_lines(catalogue)  # Look up the overlapped lines instead of typing them
     print('\nNOTE: Please enter all input triples as comma-seperated vales.'
           '\n      Enter "n" or "N" at any point to stop inputting data triples.')
-    line_dict = {}
-    emisn_line = ''
+    emisn_line = 'n' if line_dict else ''
     while emisn_line not in ('n', 'N'):
         try:
             emisn_line = input('\nEnter an emission line energy (keV), relative intensity (%), and relative intensity error (%): ')
@@ -136,10 +137,11 @@ def main():
         dens_dict[data_list[0].strip().lower()] = float(data_list[3].strip())
     comp_mix_file.close()
     #print(dens_dict)
+    catalogue = line_catalogue.load_catalogue()
     
     user_response = 'y'
     while user_response in ('y', 'Y'):
-        emisn_lines, hous_layers = getInput(dens_dict)
+        emisn_lines, hous_layers = getInput(dens_dict, catalogue)
         # print(emisn_lines)
         # print(hous_layers)
         emisn_lines_adj = adjustIntens(emisn_lines, hous_layers, dens_dict)
@@ -0,0 +1,134 @@
+# This module reads and writes calibration point files, either as the
+# comma-separated text files (source_data*.txt) or as a compact columnar
+# binary format that can be memory-mapped without parsing.
+# Points are handled as a dictionary of column name -> 1D float64 array, and
+# each column is stored as one contiguous block, so column views are unstrided
+
+import json
+import sys
+import numpy as np
+
+MAGIC = b'CALPTS2\n'
+HEADER_ALIGN = 64  # Pad header so the column blocks start on an aligned offset
+BINARY_EXT = '.cpts'
+
+# Column names and units assumed for the existing text files, by column count
+DEFAULT_COLUMNS = {
+    2: [('bin', 'bin'), ('energy', 'keV')],
+    4: [('energy', 'keV'), ('energy_error', 'keV'), ('bin', 'bin'), ('bin_error', 'bin')],
+}
+
+
+def _text_columns(n_columns, file_name, columns=None):
+    '''Returns the (name, unit) pairs for a text file with n_columns columns'''
+    if columns is None:
+        if n_columns not in DEFAULT_COLUMNS:
+            raise ValueError('Cannot infer column names for {} columns in {}; '
+                             'please pass them explicitly.'.format(n_columns, file_name))
+        columns = DEFAULT_COLUMNS[n_columns]
+    if len(columns) != n_columns:
+        raise ValueError('Expected {} columns in {}, found {}.'.format(len(columns), file_name, n_columns))
+    return [tuple(column) for column in columns]
+
+
+def _read_header(data_file, file_name):
+    '''Reads the binary header, leaving the file positioned at the data'''
+    if data_file.read(len(MAGIC)) != MAGIC:
+        raise ValueError('{} is not a calibration point file.'.format(file_name))
+    header_len = int(np.frombuffer(data_file.read(4), dtype='<u4')[0])
+    header = json.loads(data_file.read(header_len).decode('utf-8'))
+    return header, len(MAGIC) + 4 + header_len
+
+
+def _is_binary(file_name):
+    '''Checks the file for the binary format's magic bytes'''
+    with open(file_name, 'rb') as data_file:
+        return data_file.read(len(MAGIC)) == MAGIC
+
+
+def read_text(file_name, columns=None):
+    '''Reads a comma-separated calibration point file into a dictionary
+       of contiguous column arrays'''
+    raw = np.loadtxt(file_name, delimiter=',', ndmin=2, unpack=True)
+    raw = np.ascontiguousarray(raw, dtype='<f8')  # One contiguous row per column
+    columns = _text_columns(raw.shape[0], file_name, columns)
+    return {name: raw[i] for i, (name, unit) in enumerate(columns)}
+
+
+def read_binary(file_name, mmap=True):
+    '''Reads a binary calibration point file. By default the column blocks
+       are memory-mapped, so each column is a zero-copy contiguous view'''
+    with open(file_name, 'rb') as data_file:
+        header, offset = _read_header(data_file, file_name)
+    n_columns, count = len(header['columns']), header['count']
+    if count == 0:
+        raw = np.empty((n_columns, 0), dtype='<f8')
+    elif mmap:
+        raw = np.memmap(file_name, dtype='<f8', mode='r', offset=offset, shape=(n_columns, count))
+    else:
+        raw = np.fromfile(file_name, dtype='<f8', count=n_columns * count, offset=offset).reshape(n_columns, count)
+    return {name: raw[i] for i, (name, unit) in enumerate(header['columns'])}
+
+
+def read_units(file_name, columns=None):
+    '''Returns the column name to unit mapping for either file format'''
+    if _is_binary(file_name):
+        with open(file_name, 'rb') as data_file:
+            header, _ = _read_header(data_file, file_name)
+        return dict(tuple(column) for column in header['columns'])
+    with open(file_name, 'r') as data_file:
+        n_columns = len(data_file.readline().split(','))
+    return dict(_text_columns(n_columns, file_name, columns))
+
+
+def write_binary(file_name, points, units=None):
+    '''Writes a dictionary of column arrays to the binary format, one
+       contiguous block per column in dictionary order'''
+    units = units or {}
+    columns = [(name, units.get(name, '')) for name in points]
+    raw = np.stack([np.asarray(points[name], dtype='<f8') for name in points]) if points else np.empty((0, 0))
+
+    header = json.dumps({'columns': columns, 'count': raw.shape[1]}).encode('utf-8')
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % HEADER_ALIGN)
+    with open(file_name, 'wb') as data_file:
+        data_file.write(MAGIC)
+        data_file.write(np.array([len(header)], dtype='<u4').tobytes())
+        data_file.write(header)
+        raw.tofile(data_file)
+
+
+def write_text(file_name, points):
+    '''Writes calibration points back out as a comma-separated text file'''
+    raw = np.stack([points[name] for name in points], axis=1)
+    np.savetxt(file_name, raw, delimiter=',', fmt='%.10g')
+
+
+def read_points(file_name, columns=None):
+    '''Reads calibration points from either format, chosen by the file contents'''
+    if _is_binary(file_name):
+        return read_binary(file_name)
+    return read_text(file_name, columns)
+
+
+def unpack(points):
+    '''Returns a tuple of column views in stored order, matching
+       np.loadtxt(..., unpack=True) for the text files'''
+    return tuple(points.values())
+
+
+def convert(file_name, out_name=None, columns=None):
+    '''Converts a text calibration point file to the binary format'''
+    if out_name is None:
+        out_name = file_name.rsplit('.', 1)[0] + BINARY_EXT
+    write_binary(out_name, read_text(file_name, columns), read_units(file_name, columns))
+    return out_name
+
+
+def main():
+    '''Converts each text file named on the command line'''
+    for file_name in sys.argv[1:]:
+        print('{} -> {}'.format(file_name, convert(file_name)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# This program runs the peak energy calculation in reverse: given measured
+# peak energies and the emission lines overlapped in each peak, it solves
+# for the effective housing thickness of each material that best reproduces
+# them, accounting for attenuation as in the v3 peak energy calculator
+
+import warnings
+import numpy as np
+from scipy import interpolate
+from levenberg_marquardt import levenberg_marquardt
+import line_catalogue
+
+_atten_cache = {}
+
+
+def load_densities():
+    '''Reads element and compound/mixture densities (g/cm^3)
+       from the NIST tables used by the v2/v3 calculators'''
+    dens_dict = {}
+    elem_file = open('elem_densities_NIST.txt', 'r')
+    for line in elem_file:
+        data_list = line.split()
+        dens_dict[data_list[1].strip().lower()] = float(data_list[5].strip())
+    elem_file.close()
+    comp_mix_file = open('comp_mix_densities_NIST.txt', 'r')
+    for line in comp_mix_file:
+        data_list = line.split()
+        dens_dict[data_list[0].strip().lower()] = float(data_list[3].strip())
+    comp_mix_file.close()
+    return dens_dict
+
+
+def getAttenCoeff(photon_energy, hous_material):
+    '''Log-log interpolates the mass attenuation coefficient (cm^2/g) at any
+       array of energies. Each material's data file is only read once'''
+    if hous_material not in _atten_cache:
+        raw = np.loadtxt('{}_atten_data_NIST.txt'.format(hous_material.capitalize()), usecols=(0, 1), ndmin=2)
+        log_energy, log_atten = np.log(raw[:, 0] * 1000), np.log(raw[:, 1])  # Convert raw data energies from MeV to keV
+        _atten_cache[hous_material] = interpolate.interp1d(log_energy, log_atten, fill_value='extrapolate')
+    return np.exp(_atten_cache[hous_material](np.log(photon_energy)))
+
+
+def pack_lines(line_dicts):
+    '''Converts a list of v3-style line dictionaries, one per peak,
+       ({energy: {intensity: intensity error}}) into padded arrays of shape
+       (peaks, max lines). Padding lines have zero intensity'''
+    n_lines = max(len(line_dict) for line_dict in line_dicts)
+    energies = np.ones((len(line_dicts), n_lines))
+    intens = np.zeros((len(line_dicts), n_lines))
+    intens_errors = np.zeros((len(line_dicts), n_lines))
+    for i, line_dict in enumerate(line_dicts):
+        for j, (energy, intens_data) in enumerate(line_dict.items()):
+            for intens_0, intens_0_error in intens_data.items():
+                energies[i, j] = energy
+                intens[i, j] = intens_0
+                intens_errors[i, j] = intens_0_error
+    return energies, intens, intens_errors
+
+
+def atten_factors(energies, materials, dens_dict):
+    '''Attenuation exponent per mm of each material at each line energy,
+       with shape (..., lines, materials)'''
+    return np.stack([getAttenCoeff(energies, material) * dens_dict[material] / 10  # Convert per cm to per mm
+                     for material in materials], axis=-1)
+
+
+def peak_model(thick, energies, intens, intens_errors, atten):
+    '''Vectorized adjustIntens/weightedAverage chain. thick has shape
+       (B, materials); the line arrays are (peaks, lines) or (B, peaks, lines)
+       and atten is (..., lines, materials). Padding lines (zero intensity)
+       are left out of the attenuation. Returns the weighted peak energies
+       (B, peaks), their derivatives with respect to thickness
+       (B, peaks, materials) and the error from the line intensities'''
+    exponent = np.sum(atten * thick[:, np.newaxis, np.newaxis, :], axis=-1)
+    intens_factor = np.exp(-np.where(intens > 0, exponent, 0))
+    weights = intens * intens_factor
+    denom = np.sum(weights, axis=-1)
+    peak_energy = np.sum(energies * weights, axis=-1) / denom
+    offsets = (energies - peak_energy[..., np.newaxis]) / denom[..., np.newaxis]
+    thick_deriv = -np.einsum('...ml,...m->...l', atten, weights * offsets)
+    peak_energy_error = np.sqrt(np.sum((offsets * intens_factor * intens_errors) ** 2, axis=-1))
+    return peak_energy, thick_deriv, peak_energy_error
+
+
+def peak_sensitivity(intens, atten):
+    '''Flags which peaks can constrain each material, with shape
+       (..., peaks, materials). A peak only shifts with thickness if it has
+       at least two real lines that the material attenuates differently'''
+    real = (intens > 0)[..., np.newaxis]
+    highest = np.max(np.where(real, atten, -np.inf), axis=-2)
+    lowest = np.min(np.where(real, atten, np.inf), axis=-2)
+    return (np.sum(real, axis=-2) >= 2) & (highest > lowest)
+
+
+def invert_thickness(peak_energies, peak_energy_errors, energies, intens, intens_errors,
+                     materials, dens_dict, thick_guess=1.0):
+    '''Solves for the housing thickness (mm) of each material that best
+       reproduces the measured peak energies. Measured values are (peaks,)
+       for one inversion or (B, peaks) for B independent inversions, e.g. per
+       detector or time slice, which are all solved together. Thicknesses are
+       kept non-negative. Raises ValueError if a peak has no lines, or if the
+       peaks cannot constrain every material: each inversion needs at least
+       as many peaks with two or more overlapped lines as materials, and
+       their thickness derivatives must be independent.
+       Returns thicknesses (..., materials), covariance and chi-squared'''
+    single = np.ndim(peak_energies) == 1
+    peak_energies = np.atleast_2d(np.asarray(peak_energies, dtype=np.float64))
+    peak_energy_errors = np.broadcast_to(peak_energy_errors, peak_energies.shape)
+    energies, intens, intens_errors = (np.asarray(a, dtype=np.float64) for a in (energies, intens, intens_errors))
+    atten = atten_factors(energies, materials, dens_dict)
+
+    if np.any(np.sum(intens > 0, axis=-1) == 0):
+        raise ValueError('Every peak needs at least one emission line.')
+    sensitive = np.broadcast_to(peak_sensitivity(intens, atten),
+                                peak_energies.shape + (len(materials),))
+    insensitive = [material for i, material in enumerate(materials) if not np.all(np.any(sensitive[..., i], axis=-1))]
+    if insensitive:
+        raise ValueError('No peak is sensitive to the {} thickness; each needs a peak with at least '
+                         'two overlapped lines.'.format(', '.join(m.capitalize() for m in insensitive)))
+    n_sensitive = np.min(np.sum(np.any(sensitive, axis=-1), axis=-1))
+    if n_sensitive < len(materials):
+        raise ValueError('Solving for {} thicknesses needs at least {} peaks with two or more overlapped '
+                         'lines, but only {} are given.'.format(len(materials), len(materials), n_sensitive))
+
+    thick = np.broadcast_to(np.maximum(np.asarray(thick_guess, dtype=np.float64), 0),
+                            (peak_energies.shape[0], len(materials))).copy()
+    thick_deriv = peak_model(thick, energies, intens, intens_errors, atten)[1]
+    if np.any(np.linalg.matrix_rank(thick_deriv) < len(materials)):
+        raise ValueError('The peaks do not constrain the {} thicknesses independently.'
+                         .format(', '.join(m.capitalize() for m in materials)))
+
+    def resid_jac(thick):
+        model, thick_deriv, model_error = peak_model(thick, energies, intens, intens_errors, atten)
+        sigma = np.sqrt(peak_energy_errors ** 2 + model_error ** 2)
+        return (peak_energies - model) / sigma, -thick_deriv / sigma[..., np.newaxis]
+
+    thick, covar, chi2, converged = levenberg_marquardt(resid_jac, thick, lower=0.0)
+    if not np.all(converged):
+        warnings.warn('Thickness inversion did not converge for {} of {} rows.'
+                      .format(np.sum(~converged), len(converged)), RuntimeWarning)
+    if single:
+        return thick[0], covar[0], chi2[0]
+    return thick, covar, chi2
+
+
+def invert_catalogue_peaks(peak_energies, peak_energy_errors, catalogue, source, resolution,
+                           materials, dens_dict, thick_guess=1.0):
+    '''Automated inversion for peaks of one calibration source: the lines
+       overlapped in each peak are looked up in the line catalogue instead of
+       being entered. peak_energies is (peaks,) or (B, peaks); the lines are
+       looked up once from the first row, and peaks with no catalogue lines
+       are dropped. Returns the invert_thickness results and the found mask
+       of the peaks used'''
+    peak_energies = np.asarray(peak_energies, dtype=np.float64)
+    peak_energy_errors = np.broadcast_to(peak_energy_errors, peak_energies.shape)
+    energies, intens, intens_errors, found = line_catalogue.lookup_line_arrays(
+        catalogue, source, np.atleast_2d(peak_energies)[0], resolution)
+    thick, covar, chi2 = invert_thickness(peak_energies[..., found], peak_energy_errors[..., found],
+                                          energies, intens, intens_errors, materials, dens_dict, thick_guess)
+    return thick, covar, chi2, found
+
+
+def getInput(materials, catalogue):
+    '''Gets the housing materials to solve for, then each measured peak
+       with its error and overlapped emission lines, looked up in the
+       line catalogue or entered as triples'''
+    print('\nNOTE: Please enter all inputs as comma-seperated values.'
+          '\n      Enter "n" or "N" at any point to stop inputting data.')
+    hous_list = []
+    hous_layer = ''
+    while hous_layer not in ('n', 'N'):
+        hous_layer = input('\nEnter a housing material (elemental symbol) to solve for: ').strip()
+        if hous_layer not in ('n', 'N'):
+            if hous_layer.lower() in materials.keys():
+                if hous_layer.lower() not in hous_list:  # Layers of the same material are indistinguishable
+                    hous_list.append(hous_layer.lower())
+            else:
+                print('Error: Unknown material.\nPlease enter an elemental symbol or "n"/"N" to finish data input.')
+
+    peak_list = []
+    line_dicts = []
+    peak = ''
+    while peak not in ('n', 'N'):
+        try:
+            peak = input('\nEnter a measured peak energy (keV) and error (keV): ')
+            if peak in ('n', 'N'):
+                continue
+            peak = peak.split(',')
+            peak_data = (float(peak[0].strip()), float(peak[1].strip()))
+        except:
+            print('Error: Invalid input.\nPlease enter a comma-seperated data pair or "n"/"N" to finish data input.')
+            continue
+        line_dict = line_catalogue.input_lines(catalogue, peak_data[0])
+        emisn_line = 'n' if line_dict else ''
+        while emisn_line not in ('n', 'N'):
+            try:
+                emisn_line = input('  Enter an emission line energy (keV), relative intensity (%), and relative intensity error (%): ')
+                if emisn_line not in ('n', 'N'):
+                    emisn_line = emisn_line.split(',')
+                    line_dict[float(emisn_line[0].strip())] = {float(emisn_line[1].strip()): float(emisn_line[2].strip())}
+            except:
+                print('Error: Invalid input.\nPlease enter a comma-seperated data triple or "n"/"N" to finish the peak.')
+        if line_dict:
+            peak_list.append(peak_data)
+            line_dicts.append(line_dict)
+    return hous_list, peak_list, line_dicts
+
+
+def main():
+    '''Retrieves material densities, gets the peaks and solves for thickness'''
+    dens_dict = load_densities()
+    hous_list, peak_list, line_dicts = getInput(dens_dict, line_catalogue.load_catalogue())
+    if not hous_list or not peak_list:
+        print('\nAt least one housing material and one peak are needed.')
+        return
+    peak_energies, peak_energy_errors = np.array(peak_list).T
+    energies, intens, intens_errors = pack_lines(line_dicts)
+    try:
+        thick, covar, chi2 = invert_thickness(peak_energies, peak_energy_errors, energies, intens, intens_errors,
+                                              hous_list, dens_dict)
+    except ValueError as error:
+        print('\nError:', error)
+        return
+    for material, value, error in zip(hous_list, thick, np.sqrt(np.diag(covar))):
+        print('\nThe effective {} thickness is {:.4f} ± {:.4f} mm.'.format(material.capitalize(), value, error))
+    print('Chi-squared: {:.2f} for {} degrees of freedom'.format(chi2, len(peak_list) - len(hous_list)))
+
+
+if __name__ == '__main__':
+    main()
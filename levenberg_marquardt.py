@@ -0,0 +1,50 @@
+# This module holds the batched Levenberg-Marquardt least-squares solver
+# shared by the calibration fit (nai_calibration) and the housing
+# thickness inversion (housing_inversion)
+
+import numpy as np
+
+MIN_DAMPING = 1e-10
+MAX_DAMPING = 1e10
+
+
+def levenberg_marquardt(resid_jac, params, max_iter=100, tol=1e-10, lower=None):
+    '''Minimizes the sum of squared residuals independently for every row of
+       params (shape (B, P)). resid_jac(params) must return the residuals
+       (B, N) and their Jacobian (B, N, P). Each row keeps its own damping,
+       so a batch of fits costs a handful of vectorized solves. Steps are
+       clipped to the optional lower bound on the parameters, and are found
+       with a pseudo-inverse so a rank-deficient row cannot abort the batch.
+       Returns params, covariance (the pseudo-inverse of J^T J, zero for
+       parameters the residuals do not depend on), chi-squared and a mask of
+       the rows that converged within max_iter'''
+    params = np.array(params, dtype=np.float64)
+    damping = np.full(params.shape[0], 1e-3)
+    converged = np.zeros(params.shape[0], dtype=bool)
+    resid, jac = resid_jac(params)
+    chi2 = np.sum(resid ** 2, axis=-1)
+    for i in range(max_iter):
+        jtj = np.einsum('bni,bnj->bij', jac, jac)
+        grad = np.einsum('bni,bn->bi', jac, resid)
+        diag = np.maximum(np.einsum('bii->bi', jtj), 1e-12)  # Keep the damping term non-zero
+        lhs = jtj + damping[:, np.newaxis, np.newaxis] * (diag[:, :, np.newaxis] * np.eye(params.shape[1]))
+        step = -np.einsum('bij,bj->bi', np.linalg.pinv(lhs, hermitian=True), grad)
+        trial = params + step if lower is None else np.maximum(params + step, lower)
+        trial_resid, trial_jac = resid_jac(trial)
+        trial_chi2 = np.sum(trial_resid ** 2, axis=-1)
+
+        better = trial_chi2 <= chi2
+        improvement = np.where(better, chi2 - trial_chi2, 0)
+        params[better] = trial[better]
+        resid[better] = trial_resid[better]
+        jac[better] = trial_jac[better]
+        chi2 = np.where(better, trial_chi2, chi2)
+        damping = np.where(better, np.maximum(damping / 10, MIN_DAMPING), damping * 10)
+        # A rejected step still means convergence once it is negligible, as at
+        # the minimum rounding alone can make the trial chi-squared larger
+        small_step = np.all(np.abs(step) <= np.sqrt(tol) * (np.abs(params) + np.sqrt(tol)), axis=-1)
+        converged = np.where(better, improvement <= tol * (1 + chi2), small_step | (damping > MAX_DAMPING))
+        if np.all(converged):
+            break
+    jtj = np.einsum('bni,bnj->bij', jac, jac)
+    return params, np.linalg.pinv(jtj, hermitian=True), chi2, converged
@@ -4,10 +4,11 @@ import math
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
+import calib_data
 
 def get_input():
-    file_name = 'source_data_new.txt'
-    x_values, x_errors, y_values, y_errors = np.loadtxt(file_name, delimiter = ',', unpack=True)
+    file_name = 'source_data_new.txt'  # Binary .cpts files from calib_data.convert also work
+    x_values, x_errors, y_values, y_errors = calib_data.unpack(calib_data.read_points(file_name))
     return x_values, x_errors, y_values, y_errors
 
 def calc_sums(x_values, y_values, y_errors):
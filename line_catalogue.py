@@ -0,0 +1,134 @@
+# This module looks up the emission lines overlapped in a histogram peak
+# from the bundled catalogue (emission_lines.txt), so the peak energy
+# calculators no longer need every line typed in by hand
+
+import os
+import numpy as np
+
+CATALOGUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emission_lines.txt')
+REF_ENERGY = 59.5409  # keV, Am-241 gamma line at which detector resolution is quoted
+
+LINE_DTYPE = np.dtype([('source', 'U8'), ('element', 'U2'), ('transition', 'U8'),
+                       ('energy', 'f8'), ('energy_error', 'f8'),
+                       ('intens', 'f8'), ('intens_error', 'f8')])
+
+
+def load_catalogue(file_name=CATALOGUE_FILE):
+    '''Reads the line catalogue into a structured array sorted by source and
+       then energy, so both can be searched with np.searchsorted'''
+    lines = np.genfromtxt(file_name, delimiter=',', dtype=LINE_DTYPE, autostrip=True, comments='#')
+    lines = np.atleast_1d(lines)
+    lines['source'] = np.char.lower(lines['source'])  # Sources are matched case-insensitively
+    return lines[np.lexsort((lines['energy'], lines['source']))]
+
+
+def get_sources(catalogue):
+    '''Returns the calibration sources in the catalogue'''
+    return np.unique(catalogue['source']).tolist()
+
+
+def source_lines(catalogue, source):
+    '''Returns the energy-sorted lines of one source as a view of the catalogue'''
+    source = source.strip().lower()
+    start = np.searchsorted(catalogue['source'], source, side='left')
+    stop = np.searchsorted(catalogue['source'], source, side='right')
+    if start == stop:
+        raise KeyError('No lines for source {} in the catalogue.'.format(source))
+    return catalogue[start:stop]
+
+
+def fwhm(energies, resolution, ref_energy=REF_ENERGY):
+    '''Detector FWHM (keV) at each energy, from the fractional resolution
+       at the reference energy, scaling with the square root of energy'''
+    return resolution * np.sqrt(ref_energy * np.asarray(energies, dtype=np.float64))
+
+
+def find_lines_batch(catalogue, source, peak_energies, resolution, width=1.0, ref_energy=REF_ENERGY):
+    '''Finds the lines of a source within width * FWHM of each peak energy.
+       Returns the index range [start, stop) of each peak's lines in the
+       source's lines, along with those lines'''
+    lines = source_lines(catalogue, source)
+    peak_energies = np.asarray(peak_energies, dtype=np.float64)
+    half_width = width * fwhm(peak_energies, resolution, ref_energy)
+    starts = np.searchsorted(lines['energy'], peak_energies - half_width, side='left')
+    stops = np.searchsorted(lines['energy'], peak_energies + half_width, side='right')
+    return starts, stops, lines
+
+
+def find_lines(catalogue, source, peak_energy, resolution, width=1.0, ref_energy=REF_ENERGY):
+    '''Returns the lines of a source within width * FWHM of one peak energy'''
+    starts, stops, lines = find_lines_batch(catalogue, source, peak_energy, resolution, width, ref_energy)
+    return lines[int(starts):int(stops)]
+
+
+def to_line_dict(lines):
+    '''Converts catalogue lines to the v3 calculator's line dictionary,
+       {energy: {relative intensity: relative intensity error}}'''
+    return {float(line['energy']): {float(line['intens']): float(line['intens_error'])} for line in lines}
+
+
+def to_line_arrays(starts, stops, lines):
+    '''Gathers the lines of a batch query into padded (peaks, max lines)
+       arrays of energies, intensities and intensity errors, laid out like
+       housing_inversion.pack_lines. Padding lines have zero intensity.
+       Also returns a mask of peaks with no lines in their window, which
+       have only padding and must be dropped (e.g. arrays[~empty]) or
+       flagged before use, since their weighted energy is undefined'''
+    counts = stops - starts
+    empty = counts == 0
+    index = starts[:, np.newaxis] + np.arange(max(int(np.max(counts, initial=0)), 1))
+    valid = index < stops[:, np.newaxis]
+    index = np.where(valid, index, 0)
+    energies = np.where(valid, lines['energy'][index], 1.0)
+    intens = np.where(valid, lines['intens'][index], 0.0)
+    intens_errors = np.where(valid, lines['intens_error'][index], 0.0)
+    return energies, intens, intens_errors, empty
+
+
+def lookup_line_arrays(catalogue, source, peak_energies, resolution, width=1.0, ref_energy=REF_ENERGY):
+    '''Non-interactive batch lookup of the lines overlapped in many peaks of
+       one source, as padded arrays for housing_inversion.invert_thickness.
+       Peaks with no lines in their window are dropped; the returned found
+       mask marks which of the given peaks the array rows correspond to'''
+    starts, stops, lines = find_lines_batch(catalogue, source, np.atleast_1d(peak_energies),
+                                            resolution, width, ref_energy)
+    energies, intens, intens_errors, empty = to_line_arrays(starts, stops, lines)
+    found = ~empty
+    return energies[found], intens[found], intens_errors[found], found
+
+
+def lookup_line_dicts(catalogue, source, peak_energies, resolution, width=1.0, ref_energy=REF_ENERGY):
+    '''Non-interactive batch lookup returning one v3 line dictionary per
+       peak, ready for adjustIntens/weightedAverage. Peaks with no lines in
+       their window are dropped, as marked by the returned found mask'''
+    starts, stops, lines = find_lines_batch(catalogue, source, np.atleast_1d(peak_energies),
+                                            resolution, width, ref_energy)
+    found = stops > starts
+    return [to_line_dict(lines[start:stop]) for start, stop in zip(starts[found], stops[found])], found
+
+
+def input_lines(catalogue, peak_energy=None):
+    '''Asks for a calibration source, approximate peak energy (unless given)
+       and detector resolution and returns the overlapped lines as a v3 line
+       dictionary. Returns an empty dictionary if the user chooses to type
+       lines instead'''
+    fields = 'source, fractional detector resolution at {:.1f} keV'.format(REF_ENERGY) if peak_energy is not None \
+        else 'source, approximate peak energy (keV), and fractional detector resolution at {:.1f} keV'.format(REF_ENERGY)
+    while True:
+        lookup = input('\nEnter a calibration {} ({}), or press Enter to type lines in: '
+                       .format(fields, ', '.join(get_sources(catalogue))))
+        if not lookup.strip():
+            return {}
+        try:
+            lookup = [field.strip() for field in lookup.split(',')]
+            if peak_energy is not None:
+                lookup.insert(1, peak_energy)
+            lines = find_lines(catalogue, lookup[0], float(lookup[1]), float(lookup[2]))
+            if len(lines) == 0:
+                raise ValueError('No catalogue lines within the peak window.')
+            for line in lines:
+                print('  {} {:<5} {:10.4f} keV {:8.3f} ± {:.3f} %'.format(line['element'], line['transition'], line['energy'],
+                                                                          line['intens'], line['intens_error']))
+            return to_line_dict(lines)
+        except (IndexError, KeyError, ValueError) as error:
+            print('Error:', error, '\nPlease enter the requested values, or press Enter to skip.')
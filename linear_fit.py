@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.optimize as spo
+import calib_data
 
 def linear_fit(bins, intercept, slope):
     return intercept + slope*bins
@@ -14,7 +15,7 @@ def plot_fit(x_data, y_data, x_fit, y_fit):
 
 def main():
     fn = 'source_data.txt'
-    bins, peak_energies = np.loadtxt(fn, delimiter=',', unpack=True)
+    bins, peak_energies = calib_data.unpack(calib_data.read_points(fn))
     # print(bins)
     # print(peak_energies)
 
@@ -0,0 +1,151 @@
+# This program fits the histogram bin to photon energy calibration jointly
+# with the NaI(Tl) non-proportional light yield from nai_nonlinear, using
+# errors on both the line energies and the peak bins
+
+import warnings
+import numpy as np
+import calib_data
+import nai_nonlinear
+from levenberg_marquardt import levenberg_marquardt
+
+PARAM_NAMES = ('gain', 'offset', 'scale')
+
+
+def _split(params):
+    '''Splits params (..., 3) into gain, offset and scale columns that
+       broadcast against energies (..., N)'''
+    return (params[..., i, np.newaxis] for i in range(3))
+
+
+def light_yield(ratio, scale):
+    '''Relative light yield per keV from the measured non-proportionality
+       ratio, scaled by the fitted strength (0 = proportional, 1 = as measured)'''
+    return 1 + scale * (ratio - 1)
+
+
+def _model(energies, params, ratio):
+    '''Peak bins from the light-yield ratio at the energies'''
+    gain, offset, scale = _split(params)
+    return gain * energies * light_yield(ratio, scale) + offset
+
+
+def _param_jacobian(energies, params, ratio):
+    '''Derivatives of the peak bins with respect to the parameters (..., N, 3)'''
+    gain, offset, scale = _split(params)
+    return np.stack(np.broadcast_arrays(energies * light_yield(ratio, scale),
+                                        np.ones_like(gain),
+                                        gain * energies * (ratio - 1)), axis=-1)
+
+
+def _energy_deriv(params, ratio, slope):
+    '''Derivative of the peak bins with respect to energy'''
+    gain, offset, scale = _split(params)
+    return gain * (light_yield(ratio, scale) + scale * ratio * slope)
+
+
+def _energy_deriv_jacobian(params, ratio, slope):
+    '''Derivatives of _energy_deriv with respect to the parameters (..., N, 3)'''
+    gain, offset, scale = _split(params)
+    return np.stack(np.broadcast_arrays(light_yield(ratio, scale) + scale * ratio * slope,
+                                        np.zeros_like(gain),
+                                        gain * (ratio - 1 + ratio * slope)), axis=-1)
+
+
+def calib_model(energies, params):
+    '''Peak bin predicted for each line energy: gain * E * L(E) + offset.
+       params has shape (..., 3) and broadcasts against energies (..., N)'''
+    ratio, slope = nai_nonlinear.interpolated_ratio_and_slope(energies)
+    return _model(energies, params, ratio)
+
+
+def calib_jacobian(energies, params):
+    '''Analytic derivatives of calib_model. Returns the parameter Jacobian
+       with shape (..., N, 3) and the derivative with respect to energy'''
+    ratio, slope = nai_nonlinear.interpolated_ratio_and_slope(energies)
+    return _param_jacobian(energies, params, ratio), _energy_deriv(params, ratio, slope)
+
+
+def _linear_guess(energies, bins, bin_errors):
+    '''Weighted straight-line fit per channel (same sums as lin_reg with y errors.py)'''
+    weights = 1 / bin_errors ** 2
+    S = np.sum(weights, axis=-1)
+    S_x = np.sum(weights * energies, axis=-1)
+    S_y = np.sum(weights * bins, axis=-1)
+    S_xx = np.sum(weights * energies ** 2, axis=-1)
+    S_xy = np.sum(weights * energies * bins, axis=-1)
+    delta = (S_xx * S) - (S_x ** 2)
+    slope = ((S * S_xy) - (S_x * S_y)) / delta
+    y_int = ((S_xx * S_y) - (S_x * S_xy)) / delta
+    return slope, y_int
+
+
+def fit_calibration(energies, energy_errors, bins, bin_errors, fit_scale=True, scale=1.0):
+    '''Fits gain, offset and non-proportionality scale to the calibration
+       points. Inputs are (N,) for one channel or (C, N) for C channels fitted
+       together. Energy errors enter through the effective variance
+       bin_error^2 + (d bin / d E * energy_error)^2, which depends on gain and
+       scale; its derivatives are included in the Jacobian, so the solution
+       minimizes the reported chi-squared. With fit_scale=False the scale is
+       held at the given value.
+       Returns params (..., 3), covariance (..., 3, 3) and chi-squared'''
+    single = np.ndim(bins) == 1
+    energies, energy_errors, bins, bin_errors = np.broadcast_arrays(
+        *(np.atleast_2d(np.asarray(a, dtype=np.float64)) for a in (energies, energy_errors, bins, bin_errors)))
+    n_chan = energies.shape[0]
+    free = [0, 1, 2] if fit_scale else [0, 1]
+
+    slope, y_int = _linear_guess(energies, bins, bin_errors)
+    guess = np.stack([slope, y_int, np.full(n_chan, 0.0 if fit_scale else scale)], axis=-1)
+    fixed = guess.copy()
+    ratio, slope = nai_nonlinear.interpolated_ratio_and_slope(energies)
+
+    def resid_jac(free_params):
+        params = fixed.copy()
+        params[:, free] = free_params
+        energy_deriv = _energy_deriv(params, ratio, slope)
+        sigma = np.sqrt(bin_errors ** 2 + (energy_deriv * energy_errors) ** 2)
+        resid = (bins - _model(energies, params, ratio)) / sigma
+        sigma_jac = (energy_deriv * energy_errors ** 2 / sigma)[..., np.newaxis] * _energy_deriv_jacobian(params, ratio, slope)
+        jac = -(_param_jacobian(energies, params, ratio) + resid[..., np.newaxis] * sigma_jac) / sigma[..., np.newaxis]
+        return resid, jac[..., free]
+
+    free_params, free_covar, chi2, converged = levenberg_marquardt(resid_jac, guess[:, free])
+    if not np.all(converged):
+        warnings.warn('Calibration fit did not converge for {} of {} channels.'
+                      .format(np.sum(~converged), n_chan), RuntimeWarning)
+    params = fixed.copy()
+    params[:, free] = free_params
+    covar = np.zeros((n_chan, 3, 3))
+    covar[:, :len(free), :len(free)] = free_covar
+    if single:
+        return params[0], covar[0], chi2[0]
+    return params, covar, chi2
+
+
+def bins_to_energy(bins, params, n_iter=20):
+    '''Inverts the calibration with vectorized Newton steps, starting
+       from the straight-line estimate'''
+    bins = np.asarray(bins, dtype=np.float64)
+    params = np.asarray(params, dtype=np.float64)
+    gain, offset = params[..., 0, np.newaxis], params[..., 1, np.newaxis]
+    energies = np.clip((bins - offset) / gain, 1e-3, None)
+    for i in range(n_iter):
+        ratio, slope = nai_nonlinear.interpolated_ratio_and_slope(energies)
+        step = (_model(energies, params, ratio) - bins) / _energy_deriv(params, ratio, slope)
+        energies = np.clip(energies - step, 1e-3, None)
+    return energies
+
+
+def main():
+    '''Fits the calibration points and prints the result'''
+    points = calib_data.read_points('source_data_new.txt')
+    params, covar, chi2 = fit_calibration(points['energy'], points['energy_error'],
+                                          points['bin'], points['bin_error'])
+    errors = np.sqrt(np.diag(covar))
+    for name, value, error in zip(PARAM_NAMES, params, errors):
+        print('{:>6}: {:.4f} ± {:.4f}'.format(name, value, error))
+    print('Chi-squared: {:.2f} for {} degrees of freedom'.format(chi2, len(points['bin']) - len(params)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import interpolate
 from scipy.optimize import curve_fit
 
 extracted = [
@@ -65,7 +64,16 @@ def interp_extracted_test():
     plt.show()
 
 def interpolated_ratio(energy):
-    interp_func = interpolate.interp1d(loge, logp, fill_value="extrapolate")
-    return np.exp(interp_func(np.log(energy)))
+    return interpolated_ratio_and_slope(energy)[0]
+
+def interpolated_ratio_and_slope(energy):
+    '''Returns the ratio interpolated linearly in log-log space and
+       d ln(ratio) / d ln(energy), the slope of the segment each energy
+       falls on (end segments extrapolate)'''
+    log_energy = np.log(energy)
+    seg = np.searchsorted(loge, log_energy, side='right') - 1
+    seg = np.clip(seg, 0, len(loge) - 2)
+    slope = (logp[seg + 1] - logp[seg]) / (loge[seg + 1] - loge[seg])
+    return np.exp(logp[seg] + slope * (log_energy - loge[seg])), slope
 
 if __name__ == '__main__': interp_extracted_test()